@@ -328,10 +328,7 @@ class AbstractAccessToken(models.Model):
         if not scopes:
             return True
 
-        provided_scopes = set(self.scope.split())
-        resource_scopes = set(scopes)
-
-        return resource_scopes.issubset(provided_scopes)
+        return self.scope_set.issuperset(scopes)
 
     def revoke(self):
         """
@@ -340,13 +337,24 @@ class AbstractAccessToken(models.Model):
         """
         self.delete()
 
+    @property
+    def scope_set(self):
+        """
+        Returns the scopes of the token as a frozenset, splitting :attr:`scope`
+        only again when it changes
+        """
+        cached = self.__dict__.get("_scope_set")
+        if cached is None or cached[0] != self.scope:
+            cached = self.__dict__["_scope_set"] = (self.scope, frozenset(self.scope.split()))
+        return cached[1]
+
     @property
     def scopes(self):
         """
         Returns a dictionary of allowed scope names (as keys) with their descriptions (as values)
         """
         all_scopes = get_scopes_backend().get_all_scopes()
-        token_scopes = self.scope.split()
+        token_scopes = self.scope_set
         return {name: desc for name, desc in all_scopes.items() if name in token_scopes}
 
     def __str__(self):
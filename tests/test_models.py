@@ -1,7 +1,12 @@
+import functools
+from unittest import mock
+
 import pytest
+from django.apps import apps
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ImproperlyConfigured, ValidationError
-from django.test import TestCase
+from django.db.models import Count, Q
+from django.test import SimpleTestCase, TestCase
 from django.test.utils import override_settings
 from django.utils import timezone
 
@@ -22,33 +27,26 @@ RefreshToken = get_refresh_token_model()
 UserModel = get_user_model()
 
 
-class BaseTestModels(TestCase):
-    def setUp(self):
-        self.user = UserModel.objects.create_user("test_user", "test@example.com", "123456")
+def _make_access_token(**kwargs):
+    # Build an unsaved AccessToken without running Model.__init__ or its signals,
+    # for tests that only exercise pure methods
+    access_token = AccessToken.__new__(AccessToken)
+    access_token.__dict__.update(kwargs)
+    return access_token
 
-    def tearDown(self):
-        self.user.delete()
 
+class BaseTestModels(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = UserModel.objects.create_user("test_user", "test@example.com")
 
-class TestModels(BaseTestModels):
-    def test_allow_scopes(self):
-        self.client.login(username="test_user", password="123456")
-        app = Application.objects.create(
-            name="test_app",
-            redirect_uris="http://localhost http://example.com http://example.org",
-            user=self.user,
-            client_type=Application.CLIENT_CONFIDENTIAL,
-            authorization_grant_type=Application.GRANT_AUTHORIZATION_CODE,
-        )
 
-        access_token = AccessToken(user=self.user, scope="read write", expires=0, token="", application=app)
+class BaseSimpleTestModels(SimpleTestCase):
+    def setUp(self):
+        self.user = UserModel(username="test_user")
 
-        self.assertTrue(access_token.allow_scopes(["read", "write"]))
-        self.assertTrue(access_token.allow_scopes(["write", "read"]))
-        self.assertTrue(access_token.allow_scopes(["write", "read", "read"]))
-        self.assertTrue(access_token.allow_scopes([]))
-        self.assertFalse(access_token.allow_scopes(["write", "destroy"]))
 
+class TestApplicationInstance(BaseSimpleTestModels):
     def test_grant_authorization_code_redirect_uris(self):
         app = Application(
             name="test_app",
@@ -58,7 +56,8 @@ class TestModels(BaseTestModels):
             authorization_grant_type=Application.GRANT_AUTHORIZATION_CODE,
         )
 
-        self.assertRaises(ValidationError, app.full_clean)
+        with self.assertRaises(ValidationError):
+            app.clean()
 
     def test_grant_implicit_redirect_uris(self):
         app = Application(
@@ -69,7 +68,8 @@ class TestModels(BaseTestModels):
             authorization_grant_type=Application.GRANT_IMPLICIT,
         )
 
-        self.assertRaises(ValidationError, app.full_clean)
+        with self.assertRaises(ValidationError):
+            app.clean()
 
     def test_str(self):
         app = Application(
@@ -78,28 +78,10 @@ class TestModels(BaseTestModels):
             client_type=Application.CLIENT_CONFIDENTIAL,
             authorization_grant_type=Application.GRANT_IMPLICIT,
         )
-        self.assertEqual("%s" % app, app.client_id)
+        self.assertEqual(str(app), app.client_id)
 
         app.name = "test_app"
-        self.assertEqual("%s" % app, "test_app")
-
-    def test_scopes_property(self):
-        self.client.login(username="test_user", password="123456")
-
-        app = Application.objects.create(
-            name="test_app",
-            redirect_uris="http://localhost http://example.com http://example.org",
-            user=self.user,
-            client_type=Application.CLIENT_CONFIDENTIAL,
-            authorization_grant_type=Application.GRANT_AUTHORIZATION_CODE,
-        )
-
-        access_token = AccessToken(user=self.user, scope="read write", expires=0, token="", application=app)
-
-        access_token2 = AccessToken(user=self.user, scope="write", expires=0, token="", application=app)
-
-        self.assertEqual(access_token.scopes, {"read": "Reading scope", "write": "Writing scope"})
-        self.assertEqual(access_token2.scopes, {"write": "Writing scope"})
+        self.assertEqual(str(app), "test_app")
 
 
 @override_settings(
@@ -108,7 +90,24 @@ class TestModels(BaseTestModels):
     OAUTH2_PROVIDER_REFRESH_TOKEN_MODEL="tests.SampleRefreshToken",
     OAUTH2_PROVIDER_GRANT_MODEL="tests.SampleGrant",
 )
-class TestCustomModels(BaseTestModels):
+class TestCustomModels(SimpleTestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        # get_fields() populates the relation caches while the sample models are
+        # swapped in; expire them so later tests see the default models again.
+        apps.clear_cache()
+
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _related_auto_created_names(cls):
+        # Django internals caches the related objects.
+        return frozenset(
+            f.name
+            for f in UserModel._meta.get_fields()
+            if (f.one_to_many or f.one_to_one) and f.auto_created and not f.concrete
+        )
+
     def test_custom_application_model(self):
         """
         If a custom application model is installed, it should be present in
@@ -116,153 +115,71 @@ class TestCustomModels(BaseTestModels):
 
         See issue #90 (https://github.com/jazzband/django-oauth-toolkit/issues/90)
         """
-        related_object_names = [
-            f.name
-            for f in UserModel._meta.get_fields()
-            if (f.one_to_many or f.one_to_one) and f.auto_created and not f.concrete
-        ]
+        related_object_names = self._related_auto_created_names()
         self.assertNotIn("oauth2_provider:application", related_object_names)
         self.assertIn("tests_sampleapplication", related_object_names)
 
-    def test_custom_application_model_incorrect_format(self):
-        # Patch oauth2 settings to use a custom Application model
-        oauth2_settings.APPLICATION_MODEL = "IncorrectApplicationFormat"
-
-        self.assertRaises(ValueError, get_application_model)
-
-        # Revert oauth2 settings
-        oauth2_settings.APPLICATION_MODEL = "oauth2_provider.Application"
-
-    def test_custom_application_model_not_installed(self):
-        # Patch oauth2 settings to use a custom Application model
-        oauth2_settings.APPLICATION_MODEL = "tests.ApplicationNotInstalled"
-
-        self.assertRaises(LookupError, get_application_model)
-
-        # Revert oauth2 settings
-        oauth2_settings.APPLICATION_MODEL = "oauth2_provider.Application"
-
     def test_custom_access_token_model(self):
         """
         If a custom access token model is installed, it should be present in
         the related objects and not the swapped out one.
         """
-        # Django internals caches the related objects.
-        related_object_names = [
-            f.name
-            for f in UserModel._meta.get_fields()
-            if (f.one_to_many or f.one_to_one) and f.auto_created and not f.concrete
-        ]
+        related_object_names = self._related_auto_created_names()
         self.assertNotIn("oauth2_provider:access_token", related_object_names)
         self.assertIn("tests_sampleaccesstoken", related_object_names)
 
-    def test_custom_access_token_model_incorrect_format(self):
-        # Patch oauth2 settings to use a custom AccessToken model
-        oauth2_settings.ACCESS_TOKEN_MODEL = "IncorrectAccessTokenFormat"
-
-        self.assertRaises(ValueError, get_access_token_model)
-
-        # Revert oauth2 settings
-        oauth2_settings.ACCESS_TOKEN_MODEL = "oauth2_provider.AccessToken"
-
-    def test_custom_access_token_model_not_installed(self):
-        # Patch oauth2 settings to use a custom AccessToken model
-        oauth2_settings.ACCESS_TOKEN_MODEL = "tests.AccessTokenNotInstalled"
-
-        self.assertRaises(LookupError, get_access_token_model)
-
-        # Revert oauth2 settings
-        oauth2_settings.ACCESS_TOKEN_MODEL = "oauth2_provider.AccessToken"
-
     def test_custom_refresh_token_model(self):
         """
         If a custom refresh token model is installed, it should be present in
         the related objects and not the swapped out one.
         """
-        # Django internals caches the related objects.
-        related_object_names = [
-            f.name
-            for f in UserModel._meta.get_fields()
-            if (f.one_to_many or f.one_to_one) and f.auto_created and not f.concrete
-        ]
+        related_object_names = self._related_auto_created_names()
         self.assertNotIn("oauth2_provider:refresh_token", related_object_names)
         self.assertIn("tests_samplerefreshtoken", related_object_names)
 
-    def test_custom_refresh_token_model_incorrect_format(self):
-        # Patch oauth2 settings to use a custom RefreshToken model
-        oauth2_settings.REFRESH_TOKEN_MODEL = "IncorrectRefreshTokenFormat"
-
-        self.assertRaises(ValueError, get_refresh_token_model)
-
-        # Revert oauth2 settings
-        oauth2_settings.REFRESH_TOKEN_MODEL = "oauth2_provider.RefreshToken"
-
-    def test_custom_refresh_token_model_not_installed(self):
-        # Patch oauth2 settings to use a custom AccessToken model
-        oauth2_settings.REFRESH_TOKEN_MODEL = "tests.RefreshTokenNotInstalled"
-
-        self.assertRaises(LookupError, get_refresh_token_model)
-
-        # Revert oauth2 settings
-        oauth2_settings.REFRESH_TOKEN_MODEL = "oauth2_provider.RefreshToken"
-
     def test_custom_grant_model(self):
         """
         If a custom grant model is installed, it should be present in
         the related objects and not the swapped out one.
         """
-        # Django internals caches the related objects.
-        related_object_names = [
-            f.name
-            for f in UserModel._meta.get_fields()
-            if (f.one_to_many or f.one_to_one) and f.auto_created and not f.concrete
-        ]
+        related_object_names = self._related_auto_created_names()
         self.assertNotIn("oauth2_provider:grant", related_object_names)
         self.assertIn("tests_samplegrant", related_object_names)
 
-    def test_custom_grant_model_incorrect_format(self):
-        # Patch oauth2 settings to use a custom Grant model
-        oauth2_settings.GRANT_MODEL = "IncorrectGrantFormat"
-
-        self.assertRaises(ValueError, get_grant_model)
-
-        # Revert oauth2 settings
-        oauth2_settings.GRANT_MODEL = "oauth2_provider.Grant"
-
-    def test_custom_grant_model_not_installed(self):
-        # Patch oauth2 settings to use a custom AccessToken model
-        oauth2_settings.GRANT_MODEL = "tests.GrantNotInstalled"
 
-        self.assertRaises(LookupError, get_grant_model)
+@pytest.mark.parametrize(
+    "setting,getter,bad_value,exc",
+    [
+        ("APPLICATION_MODEL", get_application_model, "IncorrectApplicationFormat", ValueError),
+        ("APPLICATION_MODEL", get_application_model, "tests.ApplicationNotInstalled", LookupError),
+        ("ACCESS_TOKEN_MODEL", get_access_token_model, "IncorrectAccessTokenFormat", ValueError),
+        ("ACCESS_TOKEN_MODEL", get_access_token_model, "tests.AccessTokenNotInstalled", LookupError),
+        ("REFRESH_TOKEN_MODEL", get_refresh_token_model, "IncorrectRefreshTokenFormat", ValueError),
+        ("REFRESH_TOKEN_MODEL", get_refresh_token_model, "tests.RefreshTokenNotInstalled", LookupError),
+        ("GRANT_MODEL", get_grant_model, "IncorrectGrantFormat", ValueError),
+        ("GRANT_MODEL", get_grant_model, "tests.GrantNotInstalled", LookupError),
+    ],
+)
+def test_custom_model_setting_invalid(monkeypatch, setting, getter, bad_value, exc):
+    # Patch oauth2 settings to use a custom model, monkeypatch reverts it afterwards
+    monkeypatch.setattr(oauth2_settings, setting, bad_value)
 
-        # Revert oauth2 settings
-        oauth2_settings.GRANT_MODEL = "oauth2_provider.Grant"
+    with pytest.raises(exc):
+        getter()
 
 
 class TestGrantModel(BaseTestModels):
-    def setUp(self):
-        super().setUp()
-        self.application = Application.objects.create(
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.application = Application.objects.create(
             name="Test Application",
             redirect_uris="",
-            user=self.user,
+            user=cls.user,
             client_type=Application.CLIENT_CONFIDENTIAL,
             authorization_grant_type=Application.GRANT_AUTHORIZATION_CODE,
         )
 
-    def tearDown(self):
-        self.application.delete()
-        super().tearDown()
-
-    def test_str(self):
-        grant = Grant(code="test_code")
-        self.assertEqual("%s" % grant, grant.code)
-
-    def test_expires_can_be_none(self):
-        grant = Grant(code="test_code")
-        self.assertIsNone(grant.expires)
-        self.assertTrue(grant.is_expired())
-
     def test_redirect_uri_can_be_longer_than_255_chars(self):
         long_redirect_uri = "http://example.com/{}".format("authorized/" * 25)
         self.assertTrue(len(long_redirect_uri) > 255)
@@ -282,82 +199,133 @@ class TestGrantModel(BaseTestModels):
         self.assertEqual(grant.redirect_uri, long_redirect_uri)
 
 
-class TestAccessTokenModel(BaseTestModels):
+class TestGrantInstance(BaseSimpleTestModels):
     def test_str(self):
-        access_token = AccessToken(token="test_token")
-        self.assertEqual("%s" % access_token, access_token.token)
+        grant = Grant(code="test_code")
+        self.assertEqual(str(grant), grant.code)
 
-    def test_user_can_be_none(self):
-        app = Application.objects.create(
+    def test_expires_can_be_none(self):
+        grant = Grant(code="test_code")
+        self.assertIsNone(grant.expires)
+        self.assertTrue(grant.is_expired())
+
+
+class TestAccessTokenModel(BaseTestModels):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.app = Application.objects.create(
             name="test_app",
             redirect_uris="http://localhost http://example.com http://example.org",
-            user=self.user,
+            user=cls.user,
             client_type=Application.CLIENT_CONFIDENTIAL,
             authorization_grant_type=Application.GRANT_AUTHORIZATION_CODE,
         )
-        access_token = AccessToken.objects.create(token="test_token", application=app, expires=timezone.now())
+
+    def test_user_can_be_none(self):
+        access_token = AccessToken.objects.create(
+            token="test_token", application=self.app, expires=timezone.now()
+        )
         self.assertIsNone(access_token.user)
 
+
+class TestAccessTokenInstance(BaseSimpleTestModels):
+    def test_str(self):
+        access_token = AccessToken(token="test_token")
+        self.assertEqual(str(access_token), access_token.token)
+
     def test_expires_can_be_none(self):
         access_token = AccessToken(token="test_token")
         self.assertIsNone(access_token.expires)
         self.assertTrue(access_token.is_expired())
 
+    def test_allow_scopes(self):
+        access_token = _make_access_token(scope="read write")
+
+        self.assertTrue(access_token.allow_scopes(["read", "write"]))
+        self.assertTrue(access_token.allow_scopes(["write", "read"]))
+        self.assertTrue(access_token.allow_scopes(["write", "read", "read"]))
+        self.assertTrue(access_token.allow_scopes([]))
+        self.assertFalse(access_token.allow_scopes(["write", "destroy"]))
+
+    def test_scopes_property(self):
+        access_token = _make_access_token(scope="read write")
+        access_token2 = _make_access_token(scope="write")
+
+        self.assertEqual(access_token.scopes, {"read": "Reading scope", "write": "Writing scope"})
+        self.assertEqual(access_token2.scopes, {"write": "Writing scope"})
+
+    def test_scope_set(self):
+        access_token = AccessToken(token="test_token", scope="read write")
+        self.assertEqual(access_token.scope_set, frozenset(["read", "write"]))
+        self.assertIs(access_token.scope_set, access_token.scope_set)
 
-class TestRefreshTokenModel(BaseTestModels):
+        access_token.scope = "write"
+        self.assertEqual(access_token.scope_set, frozenset(["write"]))
+        self.assertFalse(access_token.allow_scopes(["read"]))
+
+
+class TestRefreshTokenInstance(BaseSimpleTestModels):
     def test_str(self):
         refresh_token = RefreshToken(token="test_token")
-        self.assertEqual("%s" % refresh_token, refresh_token.token)
+        self.assertEqual(str(refresh_token), refresh_token.token)
 
 
 class TestClearExpired(BaseTestModels):
-    def setUp(self):
-        super().setUp()
-        # Insert two tokens on database.
-        app = Application.objects.create(
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.app = Application.objects.create(
             name="test_app",
             redirect_uris="http://localhost http://example.com http://example.org",
-            user=self.user,
+            user=cls.user,
             client_type=Application.CLIENT_CONFIDENTIAL,
             authorization_grant_type=Application.GRANT_AUTHORIZATION_CODE,
         )
-        AccessToken.objects.create(
-            token="555",
-            expires=timezone.now(),
-            scope=2,
-            application=app,
-            user=self.user,
-            created=timezone.now(),
-            updated=timezone.now(),
-        )
-        AccessToken.objects.create(
-            token="666",
-            expires=timezone.now(),
-            scope=2,
-            application=app,
-            user=self.user,
-            created=timezone.now(),
-            updated=timezone.now(),
+        # Insert two tokens on database.
+        now = timezone.now()
+        AccessToken.objects.bulk_create(
+            [
+                AccessToken(
+                    token="555",
+                    expires=now,
+                    scope=2,
+                    application=cls.app,
+                    user=cls.user,
+                    created=now,
+                    updated=now,
+                ),
+                AccessToken(
+                    token="666",
+                    expires=now,
+                    scope=2,
+                    application=cls.app,
+                    user=cls.user,
+                    created=now,
+                    updated=now,
+                ),
+            ]
         )
 
+    @mock.patch.object(oauth2_settings, "REFRESH_TOKEN_EXPIRE_SECONDS", new=60)
     def test_clear_expired_tokens(self):
-        oauth2_settings.REFRESH_TOKEN_EXPIRE_SECONDS = 60
         assert clear_expired() is None
 
+    @mock.patch.object(oauth2_settings, "REFRESH_TOKEN_EXPIRE_SECONDS", new="A")
     def test_clear_expired_tokens_incorect_timetype(self):
-        oauth2_settings.REFRESH_TOKEN_EXPIRE_SECONDS = "A"
         with pytest.raises(ImproperlyConfigured) as excinfo:
             clear_expired()
         result = excinfo.value.__class__.__name__
         assert result == "ImproperlyConfigured"
 
+    @mock.patch.object(oauth2_settings, "REFRESH_TOKEN_EXPIRE_SECONDS", new=0)
     def test_clear_expired_tokens_with_tokens(self):
-        self.client.login(username="test_user", password="123456")
-        oauth2_settings.REFRESH_TOKEN_EXPIRE_SECONDS = 0
-        ttokens = AccessToken.objects.count()
-        expiredt = AccessToken.objects.filter(expires__lte=timezone.now()).count()
-        assert ttokens == 2
-        assert expiredt == 2
+        now = timezone.now()
+        counts = AccessToken.objects.aggregate(
+            total=Count("id"), expired=Count("id", filter=Q(expires__lte=now))
+        )
+        assert counts["total"] == 2
+        assert counts["expired"] == 2
         clear_expired()
-        expiredt = AccessToken.objects.filter(expires__lte=timezone.now()).count()
+        expiredt = AccessToken.objects.filter(expires__lte=now).count()
         assert expiredt == 0